@@ -6,7 +6,194 @@
 # Original author: Prof. Joe Hummel, Ellen Kidane
 # Edited by: Jessie Nouna
 #
+import os
+import random
 import sqlite3
+import threading
+import time
+
+
+##################################################################
+#
+# retry settings:
+#
+# When SQLite reports that the database is busy or locked (another
+# connection holds a conflicting lock), the statement is retried
+# up to BUSY_RETRIES times. The wait before retry k is chosen at
+# random between 0 and min(BUSY_MAX_DELAY, BUSY_BASE_DELAY * 2**k)
+# seconds ("full jitter" exponential backoff), so that competing
+# writers do not wake up in lock-step. Use configure_retry() to
+# change these values.
+#
+# Note that every attempt first waits up to the connection's own
+# busy timeout (sqlite3.connect's timeout, 5 seconds by default)
+# before SQLite reports the lock, so the worst-case wait is about
+# (BUSY_RETRIES + 1) * timeout plus the backoff. Interactive callers
+# should open the connection with a short timeout (see connect).
+#
+BUSY_RETRIES = 5
+BUSY_BASE_DELAY = 0.01
+BUSY_MAX_DELAY = 1.0
+
+
+##################################################################
+#
+# partition settings:
+#
+# A database may keep its Compensation rows in one SQLite file per
+# year (see partition.py). The main database then has a table
+#   CompensationPartitions(Year, Filename)
+# listing the files, relative to the main database's directory,
+# and the remaining (older) years stay in its CompensationUnpartitioned
+# table. connect() attaches each file under the schema name
+# PARTITION_PREFIX + year (e.g. Compensation_2023), and creates a
+# temporary view named Compensation over all of them.
+#
+PARTITION_PREFIX = "Compensation_"
+
+
+# per-thread count of busy/locked retries and seconds spent waiting
+# in backoff, see get_busy_stats
+_busy_stats = threading.local()
+
+
+##################################################################
+#
+# DataTierError:
+#
+# Base class of the errors raised by the data tier when a caller
+# passes raise_errors=True. The original sqlite3 exception is
+# available via the __cause__ attribute.
+#
+class DataTierError(Exception):
+    pass
+
+
+##################################################################
+#
+# NotFoundError:
+#
+# Raised by select_one_row when the query retrieves no data.
+#
+class NotFoundError(DataTierError):
+    pass
+
+
+##################################################################
+#
+# ConstraintError:
+#
+# Raised when a query violates a constraint of the database
+# (e.g. a duplicate primary key or a failed foreign key).
+#
+class ConstraintError(DataTierError):
+    pass
+
+
+##################################################################
+#
+# BusyError:
+#
+# Raised when the database is still busy / locked after all
+# retries have been used up.
+#
+class BusyError(DataTierError):
+    pass
+
+
+##################################################################
+#
+# configure_retry:
+#
+# Changes the retry settings used when the database is busy or
+# locked. Any setting passed as None is left unchanged.
+#
+# Returns: None
+#
+def configure_retry(retries=None, base_delay=None, max_delay=None):
+    global BUSY_RETRIES, BUSY_BASE_DELAY, BUSY_MAX_DELAY
+
+    if retries is not None:
+        BUSY_RETRIES = retries
+    if base_delay is not None:
+        BUSY_BASE_DELAY = base_delay
+    if max_delay is not None:
+        BUSY_MAX_DELAY = max_delay
+
+
+##################################################################
+#
+# get_busy_stats:
+#
+# Returns: a tuple (retries, seconds) giving the number of times the
+#          calling thread has retried a busy/locked statement, and
+#          the total time it has spent sleeping between retries.
+#
+def get_busy_stats():
+    return (getattr(_busy_stats, "retries", 0), getattr(_busy_stats, "wait", 0.0))
+
+
+##################################################################
+#
+# _is_busy:
+#
+# Returns: True if the given sqlite3 exception means the database
+#          was busy or locked, False otherwise.
+#
+def _is_busy(err):
+    if not isinstance(err, sqlite3.OperationalError):
+        return False
+    msg = str(err).lower()
+    return "locked" in msg or "busy" in msg
+
+
+##################################################################
+#
+# _classify:
+#
+# Returns: the DataTierError subclass matching the given exception.
+#
+def _classify(err):
+    if isinstance(err, sqlite3.IntegrityError):
+        return ConstraintError
+    elif _is_busy(err):
+        return BusyError
+    else:
+        return DataTierError
+
+
+##################################################################
+#
+# _execute:
+#
+# Executes the given query using the given cursor, retrying with
+# jittered exponential backoff while the database is busy or locked.
+# If commit is True the changes are committed as part of each
+# attempt, and a failed attempt is rolled back before retrying.
+#
+# Returns: None; if the query still fails, the sqlite3 exception
+#          is raised to the caller.
+#
+def _execute(dbConn, dbCursor, sql, parameters, commit=False):
+    attempt = 0
+    while True:
+        try:
+            dbCursor.execute(sql, parameters)
+            if commit:
+                dbConn.commit()
+            return
+        except Exception as err:
+            if commit and dbConn.in_transaction:
+                dbConn.rollback()
+            # give up on anything that isn't busy/locked, or when out of retries
+            if not _is_busy(err) or attempt >= BUSY_RETRIES:
+                raise
+            cap = min(BUSY_MAX_DELAY, BUSY_BASE_DELAY * (2 ** attempt))
+            delay = random.uniform(0, cap)
+            time.sleep(delay)
+            _busy_stats.retries = getattr(_busy_stats, "retries", 0) + 1
+            _busy_stats.wait = getattr(_busy_stats, "wait", 0.0) + delay
+            attempt += 1
 
 
 ##################################################################
@@ -21,10 +208,14 @@ import sqlite3
 # a list via parameters; this parameter is optional.
 #
 # Returns: first row retrieved by the given query, or
-#          () if no data was retrieved. If an error
+#          None if no data was retrieved. If an error
 #          occurs, a msg is output and None is returned.
+#          If raise_errors is True, NotFoundError is raised
+#          when no data was retrieved, and errors are raised
+#          as ConstraintError / BusyError / DataTierError
+#          instead of being output.
 #
-def select_one_row(dbConn, sql, parameters=None):
+def select_one_row(dbConn, sql, parameters=None, raise_errors=False):
     # if no parameters passed, set params to empty list
     if parameters is None:
         parameters = []
@@ -34,10 +225,11 @@ def select_one_row(dbConn, sql, parameters=None):
 
     try:
         # try to execute, and if successful fetch and return the first row
-        dbCursor.execute(sql, parameters)
+        _execute(dbConn, dbCursor, sql, parameters)
         row = dbCursor.fetchone()
-        return row
     except Exception as err:
+        if raise_errors:
+            raise _classify(err)(f"select_one_row failed: {err}") from err
         # if execution is unsuccessful, print error message and return None
         print(f"select_one_row failed: {err}")
         return None
@@ -45,6 +237,10 @@ def select_one_row(dbConn, sql, parameters=None):
         # clean up code that gets executed either way
         dbCursor.close()
 
+    if row is None and raise_errors:
+        raise NotFoundError("select_one_row: no data was retrieved")
+    return row
+
 
 ##################################################################
 #
@@ -60,9 +256,11 @@ def select_one_row(dbConn, sql, parameters=None):
 #
 # Returns: a list of 0 or more rows retrieved by the
 #          given query; if an error occurs a msg is
-#          output and None is returned.
+#          output and None is returned. If raise_errors
+#          is True, errors are raised as ConstraintError /
+#          BusyError / DataTierError instead.
 #
-def select_n_rows(dbConn, sql, parameters=None):
+def select_n_rows(dbConn, sql, parameters=None, raise_errors=False):
     # if no parameters passed, set params to empty list
     if parameters is None:
         parameters = []
@@ -72,10 +270,12 @@ def select_n_rows(dbConn, sql, parameters=None):
 
     try:
         # try to execute, and if successful fetch and return all rows
-        dbCursor.execute(sql, parameters)
+        _execute(dbConn, dbCursor, sql, parameters)
         rows = dbCursor.fetchall()
         return rows
     except Exception as err:
+        if raise_errors:
+            raise _classify(err)(f"select_n_rows failed: {err}") from err
         # if execution is unsuccessful, print error message and return None
         print(f"select_n_rows failed: {err}")
         return None
@@ -102,8 +302,14 @@ def select_n_rows(dbConn, sql, parameters=None):
 #          not considered an error --- it means the
 #          query did not change the database (e.g.
 #          because the where condition was false?).
+#          If raise_errors is True, errors are raised as
+#          ConstraintError / BusyError / DataTierError
+#          instead of being output.
+#
+# Busy / locked errors are retried as described under
+# "retry settings" above before being treated as errors.
 #
-def perform_action(dbConn, sql, parameters=None):
+def perform_action(dbConn, sql, parameters=None, raise_errors=False):
     # if no parameters passed, set params to empty list
     if parameters is None:
         parameters = []
@@ -113,13 +319,97 @@ def perform_action(dbConn, sql, parameters=None):
 
     try:
         # try to execute, commit the changes, and return the # of rows modified
-        dbCursor.execute(sql, parameters)
-        dbConn.commit()
+        _execute(dbConn, dbCursor, sql, parameters, commit=True)
         return dbCursor.rowcount
     except Exception as err:
+        if raise_errors:
+            raise _classify(err)(f"perform_action failed: {err}") from err
         # if execution is unsuccessful, print error message and return -1
         print(f"perform_action failed: {err}")
         return -1
     finally:
         # clean up code that gets executed either way
         dbCursor.close()
+
+
+##################################################################
+#
+# connect:
+#
+# Opens the given database file. If the database has been split
+# into per-year Compensation partitions, each partition is attached
+# and a temporary Compensation view (a UNION ALL of the partitions
+# and the unpartitioned years) is created, so queries that span years work unchanged. timeout is
+# how long SQLite itself waits on a lock before reporting the
+# database as busy (and the retries above take over); it applies to
+# every retry attempt, so keep it short when a user is waiting.
+#
+# Returns: the database connection; if an error occurs a msg is
+#          output and None is returned.
+#
+def connect(filename, timeout=5.0):
+    dbConn = sqlite3.connect(filename, timeout=timeout)
+
+    check_sql = """select count(*) from sqlite_master
+    where type = 'table' and name = 'CompensationPartitions'"""
+    result = select_one_row(dbConn, check_sql)
+    if result is None:
+        dbConn.close()
+        return None
+    if result[0] == 0:
+        return dbConn  # not partitioned
+
+    partitions = select_n_rows(dbConn, "select Year, Filename from CompensationPartitions order by Year")
+    if partitions is None:
+        dbConn.close()
+        return None
+
+    # SQLite caps the number of attached databases (10 by default)
+    limit = dbConn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(partitions) > limit:
+        print(f"connect failed: {len(partitions)} partitions exceeds the limit of {limit} attached databases; "
+              f"rerun partition.py with a smaller --recent")
+        dbConn.close()
+        return None
+
+    dbCursor = dbConn.cursor()
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        selects = ["select * from main.CompensationUnpartitioned"]
+        for year, partition_file in partitions:
+            # year is an integer from our own table, so it is safe as a schema name
+            schema = f"{PARTITION_PREFIX}{int(year)}"
+            dbCursor.execute(f"attach database ? as {schema}", (os.path.join(directory, partition_file),))
+            selects.append(f"select * from {schema}.Compensation")
+        dbCursor.execute("create temp view Compensation as " + " union all ".join(selects))
+    except Exception as err:
+        print(f"connect failed: {err}")
+        dbConn.close()
+        return None
+    finally:
+        dbCursor.close()
+
+    return dbConn
+
+
+##################################################################
+#
+# get_partitions:
+#
+# Returns: a dictionary mapping each year to the schema name of its
+#          attached Compensation partition; the dictionary is empty
+#          if the database is not partitioned (or an error occurred,
+#          in which case a msg is already output).
+#
+def get_partitions(dbConn):
+    sql = "select name from pragma_database_list where name like ?"
+    rows = select_n_rows(dbConn, sql, (PARTITION_PREFIX + "%",))
+
+    partitions = {}
+    if rows:
+        for row in rows:
+            suffix = row[0][len(PARTITION_PREFIX):]
+            if suffix.isdigit():
+                partitions[int(suffix)] = row[0]
+
+    return partitions
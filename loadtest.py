@@ -0,0 +1,617 @@
+#
+# loadtest.py
+#
+# Mixed-workload load test for the object tier. Generates a
+# synthetic Chicago Lobbyists database (or copies an existing one),
+# then replays a weighted mix of object tier operations from several
+# worker processes, each running several threads, for a fixed time.
+# Reports throughput, latency histograms, lock-wait time and error
+# rates per operation, and saves the results as JSON so that runs
+# can be compared between commits. Run as, e.g.:
+#
+#   python loadtest.py --processes 4 --threads 4 --duration 30 \
+#       --output results.json --compare baseline.json
+#
+# Author: Jessie Nouna
+#
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import datatier
+import objecttier
+
+
+# default operation mix: mostly reads, some reports, a trickle of writes
+DEFAULT_MIX = {
+    "get_lobbyists": 45,
+    "get_lobbyist_details": 40,
+    "get_top_N_lobbyists": 5,
+    "add_lobbyist_year": 5,
+    "set_salutation": 5,
+}
+
+FIRST_NAMES = ["John", "Jane", "Mary", "Robert", "Michael", "Linda", "David", "Susan",
+               "James", "Karen", "Maria", "Daniel", "Patricia", "Thomas", "Jennifer"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller",
+              "Davis", "Wilson", "Moore", "Taylor", "Anderson", "Thomas", "Martinez"]
+SALUTATIONS = ["", "Mr.", "Ms.", "Mrs.", "Dr."]
+
+# latency histogram bucket upper bounds, in milliseconds
+BUCKETS_MS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+##################################################################
+#
+# generate_database:
+#
+# Creates a synthetic database with the tables used by the object
+# tier, filled with random lobbyists, employers, clients and
+# compensation records spread over the given years.
+#
+# Returns: None
+#
+def generate_database(filename, num_lobbyists, num_employers, num_clients,
+                      num_compensation, years, seed=0):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    rng = random.Random(seed)
+    dbConn = sqlite3.connect(filename)
+    dbConn.executescript("""
+    create table LobbyistInfo (Lobbyist_ID integer primary key, Salutation text, First_Name text,
+        Middle_Initial text, Last_Name text, Suffix text, Address_1 text, Address_2 text, City text,
+        State_Initial text, ZipCode text, Country text, Email text, Phone text, Fax text);
+    create table LobbyistYears (Lobbyist_ID integer, Year integer, primary key (Lobbyist_ID, Year));
+    create table EmployerInfo (Employer_ID integer primary key, Employer_Name text);
+    create table LobbyistAndEmployer (Lobbyist_ID integer, Employer_ID integer, Year integer,
+        primary key (Lobbyist_ID, Employer_ID, Year));
+    create table ClientInfo (Client_ID integer primary key, Client_Name text);
+    create table Compensation (Compensation_ID integer primary key, Lobbyist_ID integer,
+        Client_ID integer, Compensation_Amount real, Period_Start text, Period_End text);
+    create index Compensation_Lobbyist_Index on Compensation (Lobbyist_ID);
+    """)
+
+    lobbyists = []
+    years_registered = []
+    employments = []
+    for lobbyist_id in range(1, num_lobbyists + 1):
+        lobbyists.append((lobbyist_id, rng.choice(SALUTATIONS), rng.choice(FIRST_NAMES), "",
+                          f"{rng.choice(LAST_NAMES)}{rng.randint(1, 99)}", "", "1 Main St", "",
+                          "Chicago", "IL", "60601", "USA", f"lobbyist{lobbyist_id}@example.com",
+                          f"312-555-{lobbyist_id % 10000:04d}", ""))
+        for year in rng.sample(years, min(len(years), 3)):
+            years_registered.append((lobbyist_id, year))
+            employments.append((lobbyist_id, rng.randint(1, num_employers), year))
+    dbConn.executemany("insert into LobbyistInfo values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       lobbyists)
+    dbConn.executemany("insert into LobbyistYears values (?, ?)", years_registered)
+    dbConn.executemany("insert or ignore into LobbyistAndEmployer values (?, ?, ?)", employments)
+    dbConn.executemany("insert into EmployerInfo values (?, ?)",
+                       [(i, f"Employer {i}") for i in range(1, num_employers + 1)])
+    dbConn.executemany("insert into ClientInfo values (?, ?)",
+                       [(i, f"Client {i}") for i in range(1, num_clients + 1)])
+
+    compensation = []
+    for _ in range(num_compensation):
+        year = rng.choice(years)
+        compensation.append((rng.randint(1, num_lobbyists), rng.randint(1, num_clients),
+                             round(rng.uniform(100, 50000), 2), f"{year}-01-01",
+                             f"{year}-{rng.randint(1, 12):02d}-28"))
+    dbConn.executemany("""insert into Compensation (Lobbyist_ID, Client_ID, Compensation_Amount,
+        Period_Start, Period_End) values (?, ?, ?, ?, ?)""", compensation)
+
+    dbConn.commit()
+    dbConn.close()
+
+
+##################################################################
+#
+# _run_operation:
+#
+# Performs one randomly parameterized operation of the given kind.
+# unique is a number no other call uses, so inserted years (which
+# start above any year already in the database) never collide.
+#
+# Returns: True if the operation succeeded, False if it reported an
+#          error.
+#
+def _run_operation(dbConn, op, rng, info, unique):
+    lobbyist_id = rng.randint(1, info["num_lobbyists"])
+
+    if op == "get_lobbyists":
+        if rng.random() < 0.5:
+            pattern = rng.choice(LAST_NAMES) + str(rng.randint(1, 99))
+        else:
+            pattern = rng.choice(LAST_NAMES)[:3] + "%"
+        objecttier.get_lobbyists(dbConn, pattern)
+        return True
+    elif op == "get_lobbyist_details":
+        return objecttier.get_lobbyist_details(dbConn, lobbyist_id) is not None
+    elif op == "get_top_N_lobbyists":
+        objecttier.get_top_N_lobbyists(dbConn, 10, str(rng.choice(info["years"])))
+        return True
+    elif op == "add_lobbyist_year":
+        return objecttier.add_lobbyist_year(dbConn, lobbyist_id, info["year_base"] + unique) == 1
+    elif op == "set_salutation":
+        return objecttier.set_salutation(dbConn, lobbyist_id, rng.choice(SALUTATIONS)) == 1
+    else:
+        raise ValueError(f"unknown operation: {op}")
+
+
+##################################################################
+#
+# _new_stats:
+#
+# Returns: an empty statistics record for one operation.
+#
+def _new_stats():
+    return {
+        "count": 0,
+        "errors": 0,
+        "total_ms": 0.0,
+        "max_ms": 0.0,
+        "histogram": [0] * (len(BUCKETS_MS) + 1),
+        "busy_retries": 0,
+        "lock_wait_s": 0.0,
+    }
+
+
+##################################################################
+#
+# _new_result:
+#
+# Returns: an empty result for one worker: per-operation statistics,
+#          the number of failed connection attempts, and the
+#          tracebacks of unexpected exceptions (which fail the run).
+#
+def _new_result():
+    return {
+        "operations": {},
+        "connect_failures": 0,
+        "failures": [],
+    }
+
+
+##################################################################
+#
+# _worker_thread:
+#
+# Runs operations on its own connection until the deadline, adding
+# its statistics to the given result (see _new_result). Database
+# errors count against the operation; any other exception is a bug
+# in the test or the object tier, so it is recorded as a failure and
+# the thread stops.
+#
+# Returns: None
+#
+def _worker_thread(config, info, worker_id, deadline, result):
+    try:
+        _run_worker(config, info, worker_id, deadline, result)
+    except Exception:
+        result["failures"].append(traceback.format_exc())
+
+
+##################################################################
+#
+# _run_worker:
+#
+# Does the work of _worker_thread.
+#
+# Returns: None
+#
+def _run_worker(config, info, worker_id, deadline, result):
+    rng = random.Random(config["seed"] * 100003 + worker_id)
+    # connecting reads the schema, which can itself fail while writers hold the lock;
+    # count each failed attempt and back off before trying again
+    dbConn = datatier.connect(config["database"], timeout=config["busy_timeout"])
+    delay = config["base_delay"]
+    while dbConn is None:
+        result["connect_failures"] += 1
+        if time.perf_counter() + delay >= deadline:
+            return
+        time.sleep(random.uniform(0, delay))
+        delay = min(config["max_delay"], delay * 2)
+        dbConn = datatier.connect(config["database"], timeout=config["busy_timeout"])
+    ops = list(config["mix"].keys())
+    weights = list(config["mix"].values())
+    counter = 0
+    stats = result["operations"]
+
+    try:
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, weights)[0]
+            counter += 1
+            retries_before, wait_before = datatier.get_busy_stats()
+
+            start = time.perf_counter()
+            try:
+                ok = _run_operation(dbConn, op, rng, info, worker_id * 10000000 + counter)
+            except (datatier.DataTierError, sqlite3.Error):
+                ok = False
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            retries_after, wait_after = datatier.get_busy_stats()
+            _record(stats.setdefault(op, _new_stats()), ok, elapsed_ms,
+                    retries_after - retries_before, wait_after - wait_before)
+    finally:
+        dbConn.close()
+
+
+##################################################################
+#
+# _record:
+#
+# Adds one operation's outcome to its statistics record.
+#
+# Returns: None
+#
+def _record(record, ok, elapsed_ms, busy_retries, lock_wait_s):
+    record["count"] += 1
+    record["errors"] += 0 if ok else 1
+    record["total_ms"] += elapsed_ms
+    record["max_ms"] = max(record["max_ms"], elapsed_ms)
+    bucket = 0
+    while bucket < len(BUCKETS_MS) and elapsed_ms > BUCKETS_MS[bucket]:
+        bucket += 1
+    record["histogram"][bucket] += 1
+    record["busy_retries"] += busy_retries
+    record["lock_wait_s"] += lock_wait_s
+
+
+##################################################################
+#
+# _worker_process:
+#
+# Runs config["threads"] worker threads until the deadline and puts
+# their combined result (see _new_result) on the result queue, with
+# the time the last thread finished added as "finished".
+#
+# Returns: None
+#
+def _worker_process(config, info, process_id, start_time, queue):
+    # the data tier prints a msg for every error; those are counted instead
+    sys.stdout = open(os.devnull, "w")
+
+    try:
+        datatier.configure_retry(config["retries"], config["base_delay"], config["max_delay"])
+
+        # wait for the common start so all processes overlap fully
+        delay = start_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        deadline = time.perf_counter() + config["duration"]
+
+        thread_results = [_new_result() for _ in range(config["threads"])]
+        threads = []
+        for i in range(config["threads"]):
+            worker_id = process_id * config["threads"] + i
+            threads.append(threading.Thread(target=_worker_thread,
+                                            args=(config, info, worker_id, deadline, thread_results[i])))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result = _merge(thread_results)
+    except Exception:
+        # always report back, or the parent would wait forever
+        result = _new_result()
+        result["failures"].append(traceback.format_exc())
+
+    result["finished"] = time.time()
+    queue.put(result)
+
+
+##################################################################
+#
+# _merge:
+#
+# Returns: the given results (see _new_result) added together.
+#
+def _merge(results):
+    merged = _new_result()
+    for result in results:
+        merged["connect_failures"] += result["connect_failures"]
+        merged["failures"].extend(result["failures"])
+        for op, record in result["operations"].items():
+            total = merged["operations"].setdefault(op, _new_stats())
+            for key in ("count", "errors", "total_ms", "busy_retries", "lock_wait_s"):
+                total[key] += record[key]
+            total["max_ms"] = max(total["max_ms"], record["max_ms"])
+            for i, count in enumerate(record["histogram"]):
+                total["histogram"][i] += count
+    return merged
+
+
+##################################################################
+#
+# _percentile:
+#
+# Returns: the upper bound (in ms) of the histogram bucket holding
+#          the given percentile, or the maximum latency for the
+#          overflow bucket.
+#
+def _percentile(record, pct):
+    target = record["count"] * pct / 100
+    seen = 0
+    for i, count in enumerate(record["histogram"]):
+        seen += count
+        if seen >= target and count > 0:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else record["max_ms"]
+    return record["max_ms"]
+
+
+##################################################################
+#
+# _summarize:
+#
+# Returns: the JSON-ready report for the given merged result, where
+#          elapsed is the measured wall time of the run in seconds.
+#
+def _summarize(config, merged, elapsed):
+    operations = {}
+    for op in sorted(merged["operations"]):
+        record = merged["operations"][op]
+        count = record["count"]
+        histogram = {f"<={bound}": record["histogram"][i] for i, bound in enumerate(BUCKETS_MS)}
+        histogram[f">{BUCKETS_MS[-1]}"] = record["histogram"][-1]
+        operations[op] = {
+            "count": count,
+            "errors": record["errors"],
+            "error_rate": record["errors"] / count if count else 0.0,
+            "throughput_per_s": count / elapsed,
+            "latency_ms": {
+                "mean": record["total_ms"] / count if count else 0.0,
+                "p50": _percentile(record, 50),
+                "p95": _percentile(record, 95),
+                "p99": _percentile(record, 99),
+                "max": record["max_ms"],
+            },
+            "histogram_ms": histogram,
+            "busy_retries": record["busy_retries"],
+            "lock_wait_s": record["lock_wait_s"],
+        }
+
+    records = merged["operations"].values()
+    total = sum(record["count"] for record in records)
+    errors = sum(record["errors"] for record in records)
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": config,
+        "elapsed_s": elapsed,
+        "total": {
+            "count": total,
+            "errors": errors,
+            "error_rate": errors / total if total else 0.0,
+            "throughput_per_s": total / elapsed,
+            "lock_wait_s": sum(record["lock_wait_s"] for record in records),
+            "connect_failures": merged["connect_failures"],
+        },
+        "operations": operations,
+    }
+
+
+##################################################################
+#
+# _git_commit:
+#
+# Returns: the current git commit hash, or None if not in a git
+#          repository.
+#
+def _git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+##################################################################
+#
+# _scratch_copy:
+#
+# Copies the given database (using SQLite's backup API, so the copy
+# is consistent) to a new scratch file in the same directory, so
+# that any per-year partition files it refers to are still found.
+# The load test's writes then never touch the original.
+#
+# Returns: the name of the scratch file.
+#
+def _scratch_copy(filename):
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, scratch = tempfile.mkstemp(prefix=".loadtest-", suffix=".db", dir=directory)
+    os.close(handle)
+
+    source = sqlite3.connect(filename)
+    target = sqlite3.connect(scratch)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    return scratch
+
+
+##################################################################
+#
+# run_load_test:
+#
+# Runs the load test described by config against config["database"]
+# and returns the report (see _summarize). Throughput is computed
+# over the measured time from the common start until the last worker
+# finished, not the configured duration.
+#
+# Returns: the report as a dictionary; raises RuntimeError if a
+#          worker hit an unexpected (non-database) exception.
+#
+def run_load_test(config):
+    # look up the id range and years once, so workers don't have to
+    dbConn = datatier.connect(config["database"])
+    info = {
+        "num_lobbyists": objecttier.num_lobbyists(dbConn),
+        "years": [row[0] for row in datatier.select_n_rows(dbConn,
+            "select distinct strftime('%Y', Period_End) from Compensation where Period_End is not null")],
+        "year_base": datatier.select_one_row(dbConn, "select ifnull(max(Year), 0) + 1 from LobbyistYears")[0],
+    }
+    dbConn.close()
+
+    queue = multiprocessing.Queue()
+    start_time = time.time() + 0.5
+    processes = []
+    for process_id in range(config["processes"]):
+        processes.append(multiprocessing.Process(target=_worker_process,
+                                                 args=(config, info, process_id, start_time, queue)))
+    for process in processes:
+        process.start()
+    # drain the queue before joining, so large results can't block the children
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    merged = _merge(results)
+    if merged["failures"]:
+        raise RuntimeError(f"{len(merged['failures'])} worker(s) failed; first failure:\n"
+                           + merged["failures"][0])
+
+    elapsed = max(result["finished"] for result in results) - start_time
+    return _summarize(config, merged, elapsed)
+
+
+##################################################################
+#
+# _print_report:
+#
+# Prints a table of the report, with the change relative to the
+# baseline report (if given) for throughput and p95 latency.
+#
+# Returns: None
+#
+def _print_report(report, baseline=None):
+    print(f"\nCommit: {report['commit']}  Elapsed: {report['elapsed_s']:.1f}s  "
+          f"Total: {report['total']['throughput_per_s']:,.1f} ops/s, "
+          f"{report['total']['error_rate']:.2%} errors, "
+          f"{report['total']['lock_wait_s']:.2f}s lock wait, "
+          f"{report['total']['connect_failures']} connect failures")
+    print(f"\n{'operation':<22}{'ops/s':>10}{'errors':>9}{'mean ms':>10}{'p50':>8}"
+          f"{'p95':>8}{'p99':>8}{'max':>9}{'wait s':>9}")
+    for op, result in report["operations"].items():
+        latency = result["latency_ms"]
+        print(f"{op:<22}{result['throughput_per_s']:>10,.1f}{result['error_rate']:>9.2%}"
+              f"{latency['mean']:>10.2f}{latency['p50']:>8}{latency['p95']:>8}{latency['p99']:>8}"
+              f"{latency['max']:>9.1f}{result['lock_wait_s']:>9.2f}")
+
+    if baseline is None:
+        return
+
+    print(f"\nCompared with commit {baseline.get('commit')}:")
+    for op, result in report["operations"].items():
+        old = baseline.get("operations", {}).get(op)
+        if old is None or old["throughput_per_s"] == 0:
+            continue
+        change = result["throughput_per_s"] / old["throughput_per_s"] - 1
+        print(f"  {op:<22} throughput {change:+.1%}, "
+              f"p95 {old['latency_ms']['p95']} -> {result['latency_ms']['p95']} ms")
+
+
+##################################################################
+#
+# _parse_mix:
+#
+# Parses a mix such as "get_lobbyists=50,set_salutation=5".
+#
+# Returns: dictionary of operation -> weight.
+#
+def _parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        op, weight = item.split("=")
+        if op not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation: {op}")
+        mix[op] = float(weight)
+    return mix
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mixed-workload load test for the object tier.")
+    parser.add_argument("--database", default="loadtest.db",
+                        help="database to test (generated unless --no-generate)")
+    parser.add_argument("--no-generate", action="store_true",
+                        help="test a scratch copy of the existing database instead of generating one")
+    parser.add_argument("--lobbyists", type=int, default=10000)
+    parser.add_argument("--employers", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--compensation", type=int, default=100000)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4, help="threads per process")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX,
+                        help="weighted operations, e.g. get_lobbyists=50,set_salutation=5")
+    parser.add_argument("--busy-timeout", type=float, default=0.0,
+                        help="SQLite's own lock timeout in seconds; 0 leaves all waiting to "
+                             "the data tier's retries, so lock-wait time is measured")
+    parser.add_argument("--retries", type=int, default=datatier.BUSY_RETRIES)
+    parser.add_argument("--base-delay", type=float, default=datatier.BUSY_BASE_DELAY)
+    parser.add_argument("--max-delay", type=float, default=datatier.BUSY_MAX_DELAY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to save the JSON results to")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    if args.no_generate:
+        # run against a copy, so the writes in the mix leave the original untouched
+        database = _scratch_copy(args.database)
+        print(f"Copied {args.database} to {database} ...")
+    else:
+        database = args.database
+        print(f"Generating {database} ...")
+        generate_database(database, args.lobbyists, args.employers, args.clients,
+                          args.compensation, list(range(2018, 2024)), args.seed)
+
+    config = {
+        "database": database,
+        "source_database": args.database,
+        "processes": args.processes,
+        "threads": args.threads,
+        "duration": args.duration,
+        "mix": args.mix,
+        "busy_timeout": args.busy_timeout,
+        "retries": args.retries,
+        "base_delay": args.base_delay,
+        "max_delay": args.max_delay,
+        "seed": args.seed,
+    }
+    print(f"Running for {args.duration}s with {args.processes} processes x {args.threads} threads ...")
+    try:
+        report = run_load_test(config)
+    finally:
+        if args.no_generate:
+            for suffix in ("", "-journal", "-wal", "-shm"):
+                if os.path.exists(database + suffix):
+                    os.remove(database + suffix)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    _print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
@@ -2,16 +2,17 @@
 # main
 #
 # This is a console-based application that interacts with a database
-# of Chicago lobbyists. The user can choose from 5 operations,
+# of Chicago lobbyists. The user can choose from 6 operations,
 # each providing information about lobbyists or modifying the database.
 # Results are displayed in the console.
 #
 # Author: Jessie Nouna
 #
-import sqlite3
+from datatier import connect
 from objecttier import (get_lobbyists, get_lobbyist_details, get_top_N_lobbyists,
                         num_lobbyists, num_clients, num_employers, add_lobbyist_year,
-                        set_salutation)
+                        set_salutation, create_indexes, suggest_lobbyists,
+                        get_lobbyist_compensation_history)
 
 
 ##################################################################
@@ -22,6 +23,8 @@ from objecttier import (get_lobbyists, get_lobbyist_details, get_top_N_lobbyists
 # wildcards). Searches for matching lobbyists in the database and prints
 # the number of lobbyists found and their basic details.
 # If more than 100 lobbyists are found, the user is asked to narrow the search.
+# If none are found and no wildcards were used, the closest spellings are
+# suggested instead.
 #
 # Returns: None
 #
@@ -33,7 +36,15 @@ def command1():
     # print the number of lobbyists found and if there are more than 100 lobbyists found,
     # ask user to narrow search
     print("\nNumber of lobbyists found: ", len(lob_list), "\n")
-    if len(lob_list) > 100:
+    if len(lob_list) == 0 and "%" not in name and "_" not in name:
+        # nothing matched exactly, so offer the closest spellings instead
+        suggestions = suggest_lobbyists(dbConn, name, 5)
+        if suggestions:
+            print("Did you mean:")
+            for lobbyist in suggestions:
+                print(
+                    f"{lobbyist.Lobbyist_ID} : {lobbyist.First_Name} {lobbyist.Last_Name} Phone: {lobbyist.Phone}")
+    elif len(lob_list) > 100:
         print("There are too many lobbyists to display, please narrow your search and try again...")
     else:
         # otherwise, print each lobbyist's basic information
@@ -112,7 +123,8 @@ def command3():
 # command4:
 #
 # Prompts the user for a lobbyist's ID and a year. Attempts to register the lobbyist
-# for the given year in the database. Prints whether the registration was successful.
+# for the given year in the database. Prints whether the registration was successful,
+# distinguishing an unknown lobbyist, an existing registration and a busy database.
 #
 # Returns: None
 #
@@ -125,8 +137,14 @@ def command4():
     # print a success or failure message based on the result
     if success == 1:
         print("\nLobbyist successfully registered.")
-    else:
+    elif success == 0:
         print("\nNo Lobbyist with that ID was found.")
+    elif success == -1:
+        print("\nThe database is busy, please try again...")
+    elif success == -2:
+        print("\nLobbyist is already registered for that year.")
+    else:
+        print("\nLobbyist could not be registered.")
 
 
 ##################################################################
@@ -147,8 +165,45 @@ def command5():
     # print a success or failure message based on result
     if success == 1:
         print("\nSalutation successfully set.")
-    else:
+    elif success == 0:
         print("\nNo lobbyist with that ID was found.")
+    elif success == -1:
+        print("\nThe database is busy, please try again...")
+    else:
+        print("\nSalutation could not be set.")
+
+
+##################################################################
+#
+# command6:
+#
+# Prompts the user for one or more lobbyist IDs. Retrieves each lobbyist's
+# compensation broken down by year and prints the yearly totals, number of
+# clients and the change from the previous year.
+#
+# Returns: None
+#
+def command6():
+    # prompt user for the lobbyist IDs, separated by spaces
+    lob_ids = input("\nEnter lobbyist IDs (separated by spaces): ").split()
+    # fetch the yearly compensation history of all the lobbyists at once
+    histories = get_lobbyist_compensation_history(dbConn, lob_ids)
+    if len(histories) == 0:
+        print("\nNo lobbyists with those IDs were found.")
+    for lobbyist in histories:
+        print(f"\n{lobbyist.Lobbyist_ID} : {lobbyist.First_Name} {lobbyist.Last_Name}")
+        if len(lobbyist.History) == 0:
+            print("  No compensation found.")
+        for year, total, num_clients, previous_year, change, growth in lobbyist.History:
+            line = f"  {year}: ${total:,.2f} ({num_clients} clients)"
+            # the first year has nothing to compare against; after a gap,
+            # name the year compared against rather than imply year-over-year
+            if change is not None:
+                label = "change" if previous_year == year - 1 else f"change since {previous_year}"
+                line += f", {label}: {'-' if change < 0 else '+'}${abs(change):,.2f}"
+                if growth is not None:
+                    line += f" ({growth:+.1%})"
+            print(line)
 
 
 ##################################################################
@@ -156,8 +211,14 @@ def command5():
 # main
 #
 
-# connect to the Chicago Lobbyists database
-dbConn = sqlite3.connect("Chicago_Lobbyists.db")
+# connect to the Chicago Lobbyists database (attaching any per-year partitions);
+# keep SQLite's own lock timeout short so a locked database is retried with
+# backoff by the data tier rather than blocking for seconds per attempt
+dbConn = connect("Chicago_Lobbyists.db", timeout=0.1)
+if dbConn is None:
+    raise SystemExit("Unable to open Chicago_Lobbyists.db")
+# make sure the covering indexes used by the client/employer queries exist
+create_indexes(dbConn)
 
 # print welcome message and display general statistics about the database
 print('** Welcome to the Chicago Lobbyist Database Application **')
@@ -169,7 +230,7 @@ print(f"  Number of Clients: {num_clients(dbConn):,}")
 command = ''
 # continuously prompt the user for a command until 'x' is entered to exit
 while command != 'x':
-    command = input("\nPlease enter a command (1-5, x to exit): ")
+    command = input("\nPlease enter a command (1-6, x to exit): ")
 
     # execute the corresponding command based on user input
     if command == '1':
@@ -187,6 +248,9 @@ while command != 'x':
     elif command == '5':
         # set the salutation of a lobbyist
         command5()
+    elif command == '6':
+        # display the yearly compensation history of one or more lobbyists
+        command6()
     else:
         # handle unrecognized commands, except for 'x' which exits the loop
         if command != 'x': print("**Error, unknown command, try again...")
@@ -0,0 +1,290 @@
+#
+# nameindex.py
+#
+# In-memory index over the words of lobbyist first and last names,
+# used to suggest the closest matches for a misspelled name without
+# touching the database.
+#
+# Misspellings are found with a deletion neighbourhood ("SymSpell")
+# dictionary: every string obtained by deleting up to
+# MAX_EDIT_DISTANCE characters from an indexed word points back to
+# that word. Two words within edit distance d share
+# at least one such string, so a query only has to generate its own
+# deletions and look each one up, instead of comparing against every
+# indexed word.
+#
+# Author: Jessie Nouna
+#
+from bisect import insort
+from heapq import merge
+from itertools import combinations
+
+
+# largest edit distance a suggestion may have
+MAX_EDIT_DISTANCE = 2
+
+##################################################################
+#
+# _deletions:
+#
+# Returns: the set of strings obtained by deleting up to max_distance
+#          characters from the given word (including the word itself).
+#
+def _deletions(word, max_distance):
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        shorter = set()
+        for w in frontier:
+            for i in range(len(w)):
+                shorter.add(w[:i] + w[i + 1:])
+        results |= shorter
+        frontier = shorter
+    return results
+
+
+##################################################################
+#
+# _edit_distance:
+#
+# Computes the Levenshtein distance between a and b, giving up as
+# soon as the distance is known to exceed limit.
+#
+# Returns: the edit distance, or limit + 1 if it exceeds limit.
+#
+def _edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    # a common prefix or suffix does not change the distance, and close
+    # words differ in only a few characters, so compare just the middle
+    n = min(len(a), len(b))
+    start = 0
+    while start < n and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < n - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+    if not a or not b:
+        return max(len(a), len(b))
+
+    # only cells within limit of the diagonal can stay within limit
+    over = limit + 1
+    prev = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        lo = max(1, i - limit)
+        hi = min(len(b), i + limit)
+        cur = [over] * (len(b) + 1)
+        if i <= limit:
+            cur[0] = i
+        best = cur[0]
+        for j in range(lo, hi + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            cur[j] = d
+            if d < best:
+                best = d
+        if best > limit:
+            return over
+        prev = cur
+
+    return min(prev[-1], over)
+
+
+##################################################################
+#
+# _limit:
+#
+# Returns: the largest edit distance accepted for the given query
+#          word; short words allow fewer mistakes.
+#
+def _limit(word):
+    return min(MAX_EDIT_DISTANCE, max(1, len(word) // 2))
+
+
+##################################################################
+#
+# NameIndex:
+#
+# Maps each distinct (lower-cased) word of a first or last name to
+# the lobbyists carrying it, in ascending order by ID; each deletion
+# string to the words it came from; and each pair of words of the
+# same lobbyist (e.g. first and last name) to those lobbyists, so
+# full-name queries never need to intersect large sets.
+#
+# Constructor()
+# Methods:
+#   add(lobbyist): indexes a Lobbyist object (replacing any
+#                  previous entry with the same Lobbyist_ID)
+#   remove(lobbyist_id): removes a lobbyist from the index
+#   suggest(name, k): returns up to k Lobbyist objects whose first
+#                     or last names are closest to the words of name;
+#                     lobbyists matching every word rank first, each
+#                     word of the name matching at most one word
+#
+class NameIndex:
+    def __init__(self):
+        self._lobbyists = {}  # Lobbyist_ID -> Lobbyist
+        self._names = {}      # word -> sorted list of Lobbyist_IDs
+        self._deletes = {}    # deletion string -> list of words
+        self._pairs = {}      # (word, word) -> list of Lobbyist_IDs
+
+    def __len__(self):
+        return len(self._lobbyists)
+
+    @staticmethod
+    def _words(lobbyist):
+        # index multi-word names (e.g. "Mary Ann") word by word, like queries
+        words = f"{lobbyist.First_Name or ''} {lobbyist.Last_Name or ''}".lower().split()
+        return sorted(set(words))
+
+    def _add_word(self, word, lobbyist_id):
+        ids = self._names.get(word)
+        if ids is None:
+            ids = self._names[word] = []
+            for deletion in _deletions(word, MAX_EDIT_DISTANCE):
+                self._deletes.setdefault(deletion, []).append(word)
+        # lobbyists are usually loaded in ID order, so this is normally an append
+        if not ids or ids[-1] < lobbyist_id:
+            ids.append(lobbyist_id)
+        else:
+            insort(ids, lobbyist_id)
+
+    def _remove_word(self, word, lobbyist_id):
+        ids = self._names.get(word)
+        if ids is None:
+            return
+        ids.remove(lobbyist_id)
+        # drop the word (and its deletions) once nobody has it
+        if not ids:
+            del self._names[word]
+            for deletion in _deletions(word, MAX_EDIT_DISTANCE):
+                words = self._deletes[deletion]
+                words.remove(word)
+                if not words:
+                    del self._deletes[deletion]
+
+    def add(self, lobbyist):
+        self.remove(lobbyist.Lobbyist_ID)
+        self._lobbyists[lobbyist.Lobbyist_ID] = lobbyist
+        words = self._words(lobbyist)
+        for word in words:
+            self._add_word(word, lobbyist.Lobbyist_ID)
+        for pair in combinations(words, 2):
+            self._pairs.setdefault(pair, []).append(lobbyist.Lobbyist_ID)
+
+    def remove(self, lobbyist_id):
+        lobbyist = self._lobbyists.pop(lobbyist_id, None)
+        if lobbyist is None:
+            return
+        words = self._words(lobbyist)
+        for word in words:
+            self._remove_word(word, lobbyist_id)
+        for pair in combinations(words, 2):
+            ids = self._pairs[pair]
+            ids.remove(lobbyist_id)
+            if not ids:
+                del self._pairs[pair]
+
+    def _matches(self, token):
+        # indexed words sharing a deletion with the token are the only candidates
+        limit = _limit(token)
+        matches = {}
+        candidates = set()
+        for deletion in _deletions(token, limit):
+            words = self._deletes.get(deletion)
+            if not words:
+                continue
+            deleted = len(token) - len(deletion)
+            for word in words:
+                if abs(len(word) - len(token)) > limit or word in matches:
+                    continue
+                # if one word is a deletion of the other, the distance is
+                # simply the difference in length
+                if deleted == 0 or len(word) == len(deletion):
+                    matches[word] = abs(len(word) - len(token))
+                    candidates.discard(word)
+                else:
+                    candidates.add(word)
+
+        for word in candidates:
+            dist = _edit_distance(token, word, limit)
+            if dist <= limit:
+                matches[word] = dist
+        return matches, limit
+
+    def _best_ids(self, matches, k):
+        # the k lobbyists with the closest words, ties in ascending order by ID
+        by_distance = {}
+        for word, dist in matches.items():
+            by_distance.setdefault(dist, []).append(self._names[word])
+
+        best = []
+        seen = set()
+        for dist in sorted(by_distance):
+            for lobbyist_id in merge(*by_distance[dist]):
+                if lobbyist_id not in seen:
+                    seen.add(lobbyist_id)
+                    best.append(lobbyist_id)
+                    if len(best) == k:
+                        return best
+        return best
+
+    def _score(self, words, matches, used=frozenset()):
+        # best (missed, total) over assignments of the query words to
+        # distinct words of the name, so no word counts twice
+        if not matches:
+            return (0, 0)
+        (token_matches, limit), rest = matches[0], matches[1:]
+        missed, total = self._score(words, rest, used)
+        best = (missed + 1, total + limit + 1)
+        for word in words:
+            if word in token_matches and word not in used:
+                missed, total = self._score(words, rest, used | {word})
+                best = min(best, (missed, total + token_matches[word]))
+        return best
+
+    def suggest(self, name, k):
+        # names are indexed as single words, so match each word separately
+        tokens = name.lower().split()
+        if not tokens or k < 1:
+            return []
+
+        matches = [self._matches(token) for token in tokens]
+
+        # lobbyists matching two of the words, found through the pair index
+        pairs = []
+        for (matches_a, _), (matches_b, _) in combinations(matches, 2):
+            for word_a, dist_a in matches_a.items():
+                for word_b, dist_b in matches_b.items():
+                    ids = self._pairs.get((word_a, word_b) if word_a < word_b else (word_b, word_a))
+                    if ids:
+                        pairs.append((dist_a + dist_b, ids))
+        pairs.sort(key=lambda pair: pair[0])
+
+        # with two words, that distance is the lobbyist's score, so stop
+        # once k are found and the remaining pairs are further away
+        candidates = set()
+        closest = None
+        for dist, ids in pairs:
+            if len(tokens) == 2 and len(candidates) >= k and dist > closest:
+                break
+            candidates.update(ids)
+            closest = dist
+
+        # plus the best single-word matches, in case too few match more words
+        if len(candidates) < k:
+            for token_matches, _ in matches:
+                candidates.update(self._best_ids(token_matches, k))
+
+        # rank lobbyists by the number of words they failed to match, then by
+        # the total distance (a missed word counts as just over its limit)
+        ranked = []
+        for lobbyist_id in candidates:
+            missed, total = self._score(self._words(self._lobbyists[lobbyist_id]), matches)
+            ranked.append((missed, total, lobbyist_id))
+        ranked.sort()
+
+        return [self._lobbyists[lobbyist_id] for _, _, lobbyist_id in ranked[:k]]
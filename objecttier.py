@@ -7,7 +7,24 @@
 # Original author: Ellen Kidane
 # Edited by: Jessie Nouna
 #
-from datatier import select_one_row, select_n_rows, perform_action
+from datatier import (select_one_row, select_n_rows, perform_action, get_partitions,
+                      DataTierError, NotFoundError, ConstraintError, BusyError)
+from nameindex import NameIndex
+
+
+# name index per database connection, built by load_name_index, and
+# the version of the names it reflects (see _name_index_version)
+_name_indexes = {}
+_name_index_versions = {}
+
+# above this many changed lobbyists, rebuilding the name index is
+# cheaper than applying the changes one by one
+NAME_INDEX_REBUILD_THRESHOLD = 1000
+
+# lobbyists per query in get_lobbyist_compensation_history; each id
+# is bound once, so this stays under the 999-parameter limit of
+# older SQLite builds
+HISTORY_BATCH_SIZE = 500
 
 
 ##################################################################
@@ -215,6 +232,112 @@ class LobbyistClients:
         return self._clients
 
 
+##################################################################
+#
+# ClientSummary:
+#
+# Constructor(...)
+# Properties:
+#   Client_ID: int
+#   Client_Name: string
+#   Total_Compensation: float
+#   Lobbyists: list of Lobbyist objects
+#
+class ClientSummary:
+    def __init__(self, client_id, client_name, total_compensation, lobbyists):
+        self._client_id = client_id
+        self._client_name = client_name
+        self._total_compensation = total_compensation
+        self._lobbyists = lobbyists
+
+    @property
+    def Client_ID(self):
+        return self._client_id
+
+    @property
+    def Client_Name(self):
+        return self._client_name
+
+    @property
+    def Total_Compensation(self):
+        return self._total_compensation
+
+    @property
+    def Lobbyists(self):
+        return self._lobbyists
+
+
+##################################################################
+#
+# EmployerSummary:
+#
+# Constructor(...)
+# Properties:
+#   Employer_ID: int
+#   Employer_Name: string
+#   Lobbyists: list of Lobbyist objects
+#
+class EmployerSummary:
+    def __init__(self, employer_id, employer_name, lobbyists):
+        self._employer_id = employer_id
+        self._employer_name = employer_name
+        self._lobbyists = lobbyists
+
+    @property
+    def Employer_ID(self):
+        return self._employer_id
+
+    @property
+    def Employer_Name(self):
+        return self._employer_name
+
+    @property
+    def Lobbyists(self):
+        return self._lobbyists
+
+
+##################################################################
+#
+# LobbyistHistory:
+#
+# Constructor(...)
+# Properties:
+#   Lobbyist_ID: int
+#   First_Name: string
+#   Last_Name: string
+#   History: list of (Year, Total_Compensation, Num_Clients,
+#            Previous_Year, Change, Growth_Rate) tuples in ascending
+#            order by year, where Previous_Year is the latest earlier
+#            year with compensation (not necessarily Year - 1, if the
+#            lobbyist had none in between), Change is the difference
+#            from that year and Growth_Rate is Change divided by that
+#            year's total; all three are None for the first year
+#            (Growth_Rate is also None if the previous total was 0)
+#
+class LobbyistHistory:
+    def __init__(self, lobbyist_id, first_name, last_name, history):
+        self._lobbyist_id = lobbyist_id
+        self._first_name = first_name
+        self._last_name = last_name
+        self._history = history
+
+    @property
+    def Lobbyist_ID(self):
+        return self._lobbyist_id
+
+    @property
+    def First_Name(self):
+        return self._first_name
+
+    @property
+    def Last_Name(self):
+        return self._last_name
+
+    @property
+    def History(self):
+        return self._history
+
+
 ##################################################################
 # 
 # num_lobbyists:
@@ -358,6 +481,43 @@ def get_lobbyist_details(dbConn, lobbyist_id):
                            comp)
 
 
+##################################################################
+#
+# _compensation_table:
+#
+# Returns: a tuple (table, parameters) to read a single year's
+#          compensation from, where table goes in a from clause and
+#          parameters are bound before the query's own. If the
+#          database is partitioned by year (see datatier.connect) and
+#          the year has a partition, that partition's table is
+#          returned (e.g. "Compensation_2023.Compensation"), so the
+#          query never touches the other years. If rows for that year
+#          were loaded into CompensationUnpartitioned since the last
+#          partition.py run, they are added with a union all.
+#          Otherwise ("Compensation", ()).
+#
+def _compensation_table(dbConn, year):
+    year_range = _year_range(year)
+    if year_range is None:
+        return ("Compensation", ())
+
+    schema = get_partitions(dbConn).get(int(year))
+    if schema is None:
+        return ("Compensation", ())
+
+    # uses the Period_End index on CompensationUnpartitioned (see create_indexes)
+    sql = """select exists (select 1 from main.CompensationUnpartitioned
+    where Period_End >= ? and Period_End < ?)"""
+    row = select_one_row(dbConn, sql, year_range)
+    if row is None or row[0] == 0:
+        return (f"{schema}.Compensation", ())
+
+    table = f"""(select * from {schema}.Compensation
+    union all
+    select * from main.CompensationUnpartitioned where Period_End >= ? and Period_End < ?)"""
+    return (table, year_range)
+
+
 ##################################################################
 #
 # get_top_N_lobbyists:
@@ -371,15 +531,17 @@ def get_lobbyist_details(dbConn, lobbyist_id):
 #          occurs (in which case an error msg is already output).
 #
 def get_top_N_lobbyists(dbConn, N, year):
+    # read from the year's partition, if there is one
+    table, table_parameters = _compensation_table(dbConn, year)
     # sql query to get the top N lobbyists with their total compensation
-    sql = """ select Compensation.Lobbyist_ID, First_Name, Last_Name, Phone, sum(Compensation_Amount) as Total_Compensation
-    from Compensation join LobbyistInfo on LobbyistInfo.Lobbyist_ID = Compensation.Lobbyist_ID
+    sql = f""" select Compensation.Lobbyist_ID, First_Name, Last_Name, Phone, sum(Compensation_Amount) as Total_Compensation
+    from {table} as Compensation join LobbyistInfo on LobbyistInfo.Lobbyist_ID = Compensation.Lobbyist_ID
     where strftime('%Y',Period_End) = ?
     group by Compensation.Lobbyist_ID
     order by Total_Compensation desc
     limit ?
     """
-    results = select_n_rows(dbConn, sql, (year, N,))
+    results = select_n_rows(dbConn, sql, (*table_parameters, year, N,))
 
     # create list of LobbyistClients if data was found
     lobbyistClients = []
@@ -387,12 +549,12 @@ def get_top_N_lobbyists(dbConn, N, year):
         for row in results:
             # create list of clients for each lobbyist
             curClients = []
-            clients_sql = """select distinct Compensation.Client_ID, Client_Name from ClientInfo
-            join Compensation on ClientInfo.Client_ID = Compensation.Client_ID
+            clients_sql = f"""select distinct Compensation.Client_ID, Client_Name from ClientInfo
+            join {table} as Compensation on ClientInfo.Client_ID = Compensation.Client_ID
             where Lobbyist_ID = ? and strftime('%Y',Period_End) = ?
             order by Client_Name asc
             """
-            clients = select_n_rows(dbConn, clients_sql, (row[0], year,))
+            clients = select_n_rows(dbConn, clients_sql, (*table_parameters, row[0], year,))
             for client in clients:
                 curClients.append(client[1])  # append client IDs to curClients
             # append the LobbyistClients object with the current clients
@@ -401,6 +563,453 @@ def get_top_N_lobbyists(dbConn, N, year):
     return lobbyistClients
 
 
+##################################################################
+#
+# create_indexes:
+#
+# Creates the covering indexes used by the client- and employer-
+# centric queries below, if they do not already exist:
+#   Compensation(Client_ID, Period_End, Lobbyist_ID, Compensation_Amount)
+#   LobbyistAndEmployer(Employer_ID, Lobbyist_ID)
+# With these in place the queries are answered from the indexes
+# alone, without scanning the underlying tables. If Compensation is
+# partitioned by year, the index is created in every partition and
+# on the unpartitioned years, which also get an index on Period_End
+# so _compensation_table can cheaply check for rows of a
+# partitioned year that have not been moved yet.
+#
+# Returns: 1 if the indexes exist (or were created), 0 if an
+#          internal error occurred (in which case an error msg
+#          is already output).
+#
+def create_indexes(dbConn):
+    # a partitioned Compensation is a view, so index each partition and the
+    # unpartitioned years instead
+    check_sql = """select count(*) from sqlite_master
+    where type = 'table' and name = 'CompensationUnpartitioned'"""
+    result = select_one_row(dbConn, check_sql)
+    if result is None:
+        return 0
+    tables = [("main", "CompensationUnpartitioned" if result[0] > 0 else "Compensation")]
+    for schema in get_partitions(dbConn).values():
+        tables.append((schema, "Compensation"))
+
+    sqls = []
+    if result[0] > 0:
+        sqls.append("""create index if not exists main.CompensationUnpartitioned_Period_Index
+        on CompensationUnpartitioned(Period_End)""")
+    for schema, table in tables:
+        sqls.append(f"""create index if not exists {schema}.Compensation_Client_Index
+        on {table}(Client_ID, Period_End, Lobbyist_ID, Compensation_Amount)""")
+    sqls.append("""create index if not exists LobbyistAndEmployer_Employer_Index
+        on LobbyistAndEmployer(Employer_ID, Lobbyist_ID)""")
+    # DDL reports a row count of -1, so rely on raise_errors to detect failure
+    try:
+        for sql in sqls:
+            perform_action(dbConn, sql, raise_errors=True)
+    except DataTierError as err:
+        print(err)
+        return 0
+
+    return 1
+
+
+##################################################################
+#
+# _year_range:
+#
+# Returns: the half-open range of Period_End values [start, end)
+#          covering the given year, or None if the year is invalid.
+#          Comparing against a range (rather than strftime) lets
+#          SQLite use an index on Period_End.
+#
+def _year_range(year):
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        return None
+
+    return (f"{year:04d}-01-01", f"{year + 1:04d}-01-01")
+
+
+##################################################################
+#
+# get_top_N_clients:
+#
+# gets and returns the top N clients based on the total compensation
+# they paid to lobbyists in a particular year, along with the
+# lobbyists they paid that year. Everything is retrieved with a
+# single query.
+#
+# Returns: returns a list of 0 or more ClientSummary objects, in
+#          descending order by total compensation; each client's
+#          lobbyists are in ascending order by ID. The list could
+#          be empty if the year is invalid. An empty list is also
+#          returned if an internal error occurs (in which case an
+#          error msg is already output).
+#
+def get_top_N_clients(dbConn, N, year):
+    year_range = _year_range(year)
+    if year_range is None:
+        return []
+
+    # read from the year's partition, if there is one
+    table, table_parameters = _compensation_table(dbConn, year)
+    sql = f""" with TopClients as (
+        select Client_ID, sum(Compensation_Amount) as Total_Compensation
+        from {table}
+        where Period_End >= ? and Period_End < ?
+        group by Client_ID
+        order by Total_Compensation desc
+        limit ?
+    ),
+    ClientLobbyists as (
+        select distinct Compensation.Client_ID, Compensation.Lobbyist_ID
+        from {table} as Compensation join TopClients on TopClients.Client_ID = Compensation.Client_ID
+        where Period_End >= ? and Period_End < ?
+    )
+    select TopClients.Client_ID, Client_Name, TopClients.Total_Compensation,
+           LobbyistInfo.Lobbyist_ID, LobbyistInfo.First_Name, LobbyistInfo.Last_Name, LobbyistInfo.Phone
+    from TopClients
+    join ClientInfo on ClientInfo.Client_ID = TopClients.Client_ID
+    left join ClientLobbyists on ClientLobbyists.Client_ID = TopClients.Client_ID
+    left join LobbyistInfo on LobbyistInfo.Lobbyist_ID = ClientLobbyists.Lobbyist_ID
+    order by TopClients.Total_Compensation desc, TopClients.Client_ID asc, LobbyistInfo.Lobbyist_ID asc
+    """
+    results = select_n_rows(dbConn, sql, (*table_parameters, year_range[0], year_range[1], N,
+                                          *table_parameters, year_range[0], year_range[1],))
+
+    # rows arrive grouped by client, so build one ClientSummary per group
+    clients = []
+    if results:
+        cur = None
+        for row in results:
+            if cur is None or cur.Client_ID != row[0]:
+                cur = ClientSummary(row[0], row[1], row[2], [])
+                clients.append(cur)
+            if row[3] is not None:
+                cur.Lobbyists.append(Lobbyist(row[3], row[4], row[5], row[6]))
+
+    return clients
+
+
+##################################################################
+#
+# get_client_lobbyists:
+#
+# gets and returns the given client along with every lobbyist it
+# has paid and its total compensation across all years, using a
+# single query.
+#
+# Returns: if the search was successful, a ClientSummary object
+#          is returned, with lobbyists in ascending order by ID.
+#          If the client does not exist, None is returned; note
+#          that None is also returned if an internal error
+#          occurred (in which case an error msg is already output).
+#
+def get_client_lobbyists(dbConn, client_id):
+    sql = """ select ClientInfo.Client_ID, Client_Name,
+           (select sum(Compensation_Amount) from Compensation where Client_ID = ?),
+           LobbyistInfo.Lobbyist_ID, LobbyistInfo.First_Name, LobbyistInfo.Last_Name, LobbyistInfo.Phone
+    from ClientInfo
+    left join (select distinct Lobbyist_ID from Compensation where Client_ID = ?) as ClientLobbyists
+    left join LobbyistInfo on LobbyistInfo.Lobbyist_ID = ClientLobbyists.Lobbyist_ID
+    where ClientInfo.Client_ID = ?
+    order by LobbyistInfo.Lobbyist_ID asc
+    """
+    results = select_n_rows(dbConn, sql, (client_id, client_id, client_id,))
+
+    if not results:
+        return None
+
+    lobbyists = []
+    for row in results:
+        if row[3] is not None:
+            lobbyists.append(Lobbyist(row[3], row[4], row[5], row[6]))
+
+    total = results[0][2] if results[0][2] is not None else 0
+    return ClientSummary(results[0][0], results[0][1], total, lobbyists)
+
+
+##################################################################
+#
+# get_employer_lobbyists:
+#
+# gets and returns the given employer along with every lobbyist
+# who has worked for it, using a single query.
+#
+# Returns: if the search was successful, an EmployerSummary object
+#          is returned, with lobbyists in ascending order by ID.
+#          If the employer does not exist, None is returned; note
+#          that None is also returned if an internal error
+#          occurred (in which case an error msg is already output).
+#
+def get_employer_lobbyists(dbConn, employer_id):
+    sql = """ select EmployerInfo.Employer_ID, Employer_Name,
+           LobbyistInfo.Lobbyist_ID, LobbyistInfo.First_Name, LobbyistInfo.Last_Name, LobbyistInfo.Phone
+    from EmployerInfo
+    left join (select distinct Lobbyist_ID from LobbyistAndEmployer where Employer_ID = ?) as EmployerLobbyists
+    left join LobbyistInfo on LobbyistInfo.Lobbyist_ID = EmployerLobbyists.Lobbyist_ID
+    where EmployerInfo.Employer_ID = ?
+    order by LobbyistInfo.Lobbyist_ID asc
+    """
+    results = select_n_rows(dbConn, sql, (employer_id, employer_id,))
+
+    if not results:
+        return None
+
+    lobbyists = []
+    for row in results:
+        if row[2] is not None:
+            lobbyists.append(Lobbyist(row[2], row[3], row[4], row[5]))
+
+    return EmployerSummary(results[0][0], results[0][1], lobbyists)
+
+
+##################################################################
+#
+# track_name_changes:
+#
+# Creates (if needed) the LobbyistNameChanges table and the triggers
+# that append a row to it whenever a lobbyist is added, deleted, or
+# has their name or ID changed, by any connection or program. Name
+# indexes then apply just those changes, instead of being rebuilt
+# whenever another connection writes to the database. This changes
+# the schema, so it is never done implicitly: run it once on
+# databases whose lobbyist names change while the application runs.
+#
+# Returns: 1 if changes are tracked, 0 if not (an internal error
+#          occurred, e.g. the database is read-only, in which case
+#          an error msg is already output).
+#
+def track_name_changes(dbConn):
+    sqls = [
+        """create table if not exists LobbyistNameChanges
+        (Seq integer primary key autoincrement, Lobbyist_ID integer not null)""",
+        """create trigger if not exists LobbyistNameInsert after insert on LobbyistInfo
+        begin
+            insert into LobbyistNameChanges (Lobbyist_ID) values (new.Lobbyist_ID);
+        end""",
+        """create trigger if not exists LobbyistNameDelete after delete on LobbyistInfo
+        begin
+            insert into LobbyistNameChanges (Lobbyist_ID) values (old.Lobbyist_ID);
+        end""",
+        """create trigger if not exists LobbyistNameUpdate
+        after update of Lobbyist_ID, First_Name, Last_Name on LobbyistInfo
+        begin
+            insert into LobbyistNameChanges (Lobbyist_ID) values (old.Lobbyist_ID);
+            insert into LobbyistNameChanges (Lobbyist_ID) values (new.Lobbyist_ID);
+        end""",
+    ]
+    # DDL reports a row count of -1, so rely on raise_errors to detect failure
+    try:
+        for sql in sqls:
+            perform_action(dbConn, sql, raise_errors=True)
+    except DataTierError as err:
+        print(err)
+        return 0
+
+    # indexes built before tracking started will pick it up when rebuilt
+    _name_indexes.pop(dbConn, None)
+    _name_index_versions.pop(dbConn, None)
+
+    return 1
+
+
+##################################################################
+#
+# _name_index_version:
+#
+# Returns: the current version of the lobbyist names, as a tuple
+#          ("changes", latest LobbyistNameChanges Seq) if changes are
+#          tracked, or ("data_version", SQLite data version) if not;
+#          None if an internal error occurred.
+#
+def _name_index_version(dbConn):
+    sql = "select count(*) from sqlite_master where type = 'table' and name = 'LobbyistNameChanges'"
+    row = select_one_row(dbConn, sql)
+    if row is None:
+        return None
+
+    if row[0] == 0:
+        # changes by other connections can only be detected wholesale
+        row = select_one_row(dbConn, "pragma data_version")
+        return None if row is None else ("data_version", row[0])
+
+    row = select_one_row(dbConn, "select ifnull(max(Seq), 0) from LobbyistNameChanges")
+    return None if row is None else ("changes", row[0])
+
+
+##################################################################
+#
+# load_name_index:
+#
+# Reads the first and last names of every lobbyist and builds the
+# in-memory name index used by suggest_lobbyists for the given
+# connection, replacing any index built earlier. suggest_lobbyists
+# calls this on first use, so the cost is only paid by sessions that
+# need a suggestion. Later name changes are picked up before each
+# suggestion (see track_name_changes and _apply_name_changes).
+#
+# Returns: the number of lobbyists indexed, or -1 if an internal
+#          error occurred (in which case an error msg is already
+#          output).
+#
+def load_name_index(dbConn):
+    # note the version before reading names, so no change can be missed
+    version = _name_index_version(dbConn)
+    if version is None:
+        return -1
+
+    sql = "select Lobbyist_ID, First_Name, Last_Name, Phone from LobbyistInfo"
+    results = select_n_rows(dbConn, sql)
+    if results is None:
+        return -1
+
+    index = NameIndex()
+    for row in results:
+        index.add(Lobbyist(row[0], row[1], row[2], row[3]))
+    _name_indexes[dbConn] = index
+    _name_index_versions[dbConn] = version
+
+    return len(index)
+
+
+##################################################################
+#
+# refresh_name_index:
+#
+# Re-reads the given lobbyist and updates the name index to match,
+# for callers that change a lobbyist's name through this connection.
+# Does nothing if no index has been loaded yet.
+#
+# Returns: 1 if the index was updated, 0 if not (no index loaded,
+#          or an internal error occurred).
+#
+def refresh_name_index(dbConn, lobbyist_id):
+    index = _name_indexes.get(dbConn)
+    if index is None:
+        return 0
+
+    sql = "select Lobbyist_ID, First_Name, Last_Name, Phone from LobbyistInfo where Lobbyist_ID = ?"
+    try:
+        row = select_one_row(dbConn, sql, (lobbyist_id,), raise_errors=True)
+    except NotFoundError:
+        # lobbyist no longer exists, so drop them from the index
+        index.remove(int(lobbyist_id))
+        return 1
+    except DataTierError as err:
+        print(err)
+        return 0
+
+    index.add(Lobbyist(row[0], row[1], row[2], row[3]))
+    return 1
+
+
+##################################################################
+#
+# _trim_name_changes:
+#
+# Deletes the LobbyistNameChanges entries that every name index
+# loaded in this process has already applied. Indexes in other
+# processes that still needed them notice the gap and rebuild.
+# Trimming is best effort: if the database is busy or read-only,
+# the entries are simply trimmed next time.
+#
+# Returns: None
+#
+def _trim_name_changes(dbConn):
+    versions = [version for kind, version in _name_index_versions.values() if kind == "changes"]
+    if not versions:
+        return
+
+    try:
+        perform_action(dbConn, "delete from LobbyistNameChanges where Seq <= ?",
+                       (min(versions),), raise_errors=True)
+    except DataTierError:
+        pass
+
+
+##################################################################
+#
+# _apply_name_changes:
+#
+# Brings the name index up to date before a suggestion. If changes
+# are tracked, the lobbyists recorded in LobbyistNameChanges since
+# the index was built are re-read with a single query, unless there
+# are more than NAME_INDEX_REBUILD_THRESHOLD of them (e.g. after a
+# bulk load) or entries were trimmed before this index applied them,
+# in which case the index is rebuilt. If changes are not tracked,
+# the index is rebuilt whenever another connection has written to
+# the database.
+#
+# Returns: None
+#
+def _apply_name_changes(dbConn):
+    kind, version = _name_index_versions[dbConn]
+    if kind == "data_version":
+        row = select_one_row(dbConn, "pragma data_version")
+        if row is not None and row[0] != version:
+            load_name_index(dbConn)
+        return
+
+    sql = """select (select min(Seq) from LobbyistNameChanges), max(Seq), count(distinct Lobbyist_ID)
+    from LobbyistNameChanges where Seq > ?"""
+    row = select_one_row(dbConn, sql, (version,))
+    if row is None or row[2] == 0:
+        return
+    oldest, latest, changed = row
+
+    if oldest > version + 1 or changed > NAME_INDEX_REBUILD_THRESHOLD:
+        if load_name_index(dbConn) == -1:
+            return  # try again next time
+    else:
+        changes = "select Lobbyist_ID from LobbyistNameChanges where Seq > ? and Seq <= ?"
+        ids = select_n_rows(dbConn, changes, (version, latest))
+        sql = f"""select Lobbyist_ID, First_Name, Last_Name, Phone from LobbyistInfo
+        where Lobbyist_ID in ({changes})"""
+        results = select_n_rows(dbConn, sql, (version, latest))
+        if ids is None or results is None:
+            return  # try again next time
+
+        # removing first also drops lobbyists that were deleted (or renumbered)
+        index = _name_indexes[dbConn]
+        for id_row in ids:
+            index.remove(id_row[0])
+        for row in results:
+            index.add(Lobbyist(row[0], row[1], row[2], row[3]))
+        _name_index_versions[dbConn] = (kind, latest)
+
+    _trim_name_changes(dbConn)
+
+
+##################################################################
+#
+# suggest_lobbyists:
+#
+# gets and returns the k lobbyists whose names are the closest (by
+# edit distance) to the given name, which is typically a misspelling.
+# First and last names are indexed as single words, so each
+# whitespace-separated word of the given name is matched on its own
+# against both; e.g. "Jon Smiht" finds John Smith. Lobbyists matching
+# every word rank first. Wildcards are not supported. The lookup uses
+# the in-memory name index, loading it first if necessary.
+#
+# Returns: list of 0 or more Lobbyist objects, closest match first
+#          (ties in ascending order by ID); an empty list means no
+#          name was close enough (or an internal error occurred,
+#          in which case an error msg is already output).
+#
+def suggest_lobbyists(dbConn, name, k):
+    if dbConn not in _name_indexes:
+        if load_name_index(dbConn) == -1:
+            return []
+    else:
+        _apply_name_changes(dbConn)
+
+    return _name_indexes[dbConn].suggest(name, k)
+
+
 ##################################################################
 #
 # add_lobbyist_year:
@@ -410,26 +1019,36 @@ def get_top_N_lobbyists(dbConn, N, year):
 # and the year is not inserted.
 #
 # Returns: 1 if the year was successfully added,
-#          0 if not (e.g. if the lobbyist does not exist, or if
-#          an internal error occurred).
+#          0 if the lobbyist does not exist,
+#          -1 if the database was still busy after retrying (the
+#             call may succeed if tried again later),
+#          -2 if the year violates a constraint (e.g. the lobbyist
+#             is already registered for that year),
+#          -3 if any other internal error occurred.
+#          For -1, -2 and -3 an error msg is already output.
 #
 def add_lobbyist_year(dbConn, lobbyist_id, year):
     # check if the lobbyist exists
-    sql_check = "select count(*) from LobbyistInfo where Lobbyist_ID = ?"
-    result = select_one_row(dbConn, sql_check, (lobbyist_id,))
-
-    if result is None or result[0] == 0:
-        # lobbyist doesn't exist or an error occurred
-        return 0
-
+    sql_check = "select Lobbyist_ID from LobbyistInfo where Lobbyist_ID = ?"
     # insert the year into the database for the lobbyist
     sql_insert = "insert into LobbyistYears (Lobbyist_ID, Year) values (?, ?)"
-    # execute the insertion (assuming execute_query handles the insertion)
-    execution = perform_action(dbConn, sql_insert, (lobbyist_id, year))
-    if execution == -1:
-        return 0  # execution fail
-    else:
-        return 1  # execution success
+
+    try:
+        select_one_row(dbConn, sql_check, (lobbyist_id,), raise_errors=True)
+        perform_action(dbConn, sql_insert, (lobbyist_id, year), raise_errors=True)
+    except NotFoundError:
+        return 0  # lobbyist doesn't exist
+    except BusyError as err:
+        print(err)
+        return -1  # database busy
+    except ConstraintError as err:
+        print(err)
+        return -2  # e.g. year already registered
+    except DataTierError as err:
+        print(err)
+        return -3  # execution fail
+
+    return 1  # execution success
 
 
 ##################################################################
@@ -444,23 +1063,93 @@ def add_lobbyist_year(dbConn, lobbyist_id, year):
 # is not set.
 #
 # Returns: 1 if the salutation was successfully set,
-#          0 if not (e.g. if the lobbyist does not exist, or if
-#          an internal error occurred).
+#          0 if the lobbyist does not exist,
+#          -1 if the database was still busy after retrying (the
+#             call may succeed if tried again later),
+#          -2 if the salutation violates a constraint,
+#          -3 if any other internal error occurred.
+#          For -1, -2 and -3 an error msg is already output.
 #
 def set_salutation(dbConn, lobbyist_id, salutation):
-    # check if the lobbyist exists
-    sql_check = "select count(*) from LobbyistInfo where Lobbyist_ID = ?"
-    result = select_one_row(dbConn, sql_check, (lobbyist_id,))
+    # update the salutation; a row count of 0 means no such lobbyist
+    sql_update = "update LobbyistInfo set Salutation = ? where Lobbyist_ID = ?"
 
-    if result is None or result[0] == 0:
-        # lobbyist doesn't exist or an error occurred
-        return 0
+    try:
+        modified = perform_action(dbConn, sql_update, (salutation, lobbyist_id), raise_errors=True)
+    except BusyError as err:
+        print(err)
+        return -1  # database busy
+    except ConstraintError as err:
+        print(err)
+        return -2  # salutation not allowed
+    except DataTierError as err:
+        print(err)
+        return -3  # execution fail
 
-    # insert the year into the database for the lobbyist
-    sql_insert = "update LobbyistInfo set Salutation = ? where Lobbyist_ID = ?"
-    # execute the insertion (assuming execute_query handles the insertion)
-    execution = perform_action(dbConn, sql_insert, (salutation, lobbyist_id))
-    if execution == -1:
-        return 0  # execution fail
-    else:
-        return 1  # execution success
+    if modified == 0:
+        return 0  # lobbyist doesn't exist
+    return 1  # execution success
+
+
+##################################################################
+#
+# get_lobbyist_compensation_history:
+#
+# gets and returns the compensation of each of the given lobbyists
+# broken down by year, with the number of distinct clients and the
+# change from the previous year with compensation (which is named,
+# since it may not be the year before). The per-year totals and the
+# changes (via the LAG() window function) are computed by a single
+# aggregate query per batch of up to HISTORY_BATCH_SIZE lobbyists.
+#
+# Returns: list of LobbyistHistory objects in ascending order by ID,
+#          one per lobbyist that exists (with an empty History if
+#          the lobbyist has no compensation); an empty list is also
+#          returned if an internal error occurred (in which case an
+#          error msg is already output).
+#
+def get_lobbyist_compensation_history(dbConn, lobbyist_ids):
+    # drop duplicate ids, so no lobbyist is returned twice
+    lobbyist_ids = list(dict.fromkeys(lobbyist_ids))
+    histories = []
+
+    for start in range(0, len(lobbyist_ids), HISTORY_BATCH_SIZE):
+        batch = lobbyist_ids[start:start + HISTORY_BATCH_SIZE]
+        # bind each id once, in a table both the aggregate and the lookup join against
+        values = ", ".join(["(?)"] * len(batch))
+        sql = f""" with Ids(Lobbyist_ID) as (values {values}),
+        Yearly as (
+            select Lobbyist_ID, cast(strftime('%Y', Period_End) as integer) as Year,
+                   sum(Compensation_Amount) as Total, count(distinct Client_ID) as Num_Clients
+            from Compensation
+            where Lobbyist_ID in (select Lobbyist_ID from Ids) and Period_End is not null
+            group by Lobbyist_ID, Year
+        ),
+        Changes as (
+            select Lobbyist_ID, Year, Total, Num_Clients,
+                   lag(Year) over (partition by Lobbyist_ID order by Year) as Previous_Year,
+                   Total - lag(Total) over (partition by Lobbyist_ID order by Year) as Change,
+                   lag(Total) over (partition by Lobbyist_ID order by Year) as Previous
+            from Yearly
+        )
+        select LobbyistInfo.Lobbyist_ID, First_Name, Last_Name,
+               Year, Total, Num_Clients, Previous_Year, Change, Change * 1.0 / nullif(Previous, 0)
+        from LobbyistInfo left join Changes on Changes.Lobbyist_ID = LobbyistInfo.Lobbyist_ID
+        where LobbyistInfo.Lobbyist_ID in (select Lobbyist_ID from Ids)
+        order by LobbyistInfo.Lobbyist_ID asc, Year asc
+        """
+        results = select_n_rows(dbConn, sql, batch)
+        if results is None:
+            return []
+
+        # rows arrive grouped by lobbyist, so build one LobbyistHistory per group
+        cur = None
+        for row in results:
+            if cur is None or cur.Lobbyist_ID != row[0]:
+                cur = LobbyistHistory(row[0], row[1], row[2], [])
+                histories.append(cur)
+            if row[3] is not None:
+                cur.History.append((row[3], row[4], row[5], row[6], row[7], row[8]))
+
+    histories.sort(key=lambda history: history.Lobbyist_ID)
+    return histories
@@ -0,0 +1,215 @@
+#
+# partition.py
+#
+# Splits the Compensation table of an existing Chicago Lobbyists
+# database into one SQLite file per year, for use with the
+# partitioned layout understood by datatier.connect. Run as:
+#
+#   python partition.py Chicago_Lobbyists.db [--recent N]
+#
+# Only the N most recent years (5 by default) get their own file,
+# <database>_Compensation_<year>.db next to the database; the files
+# are recorded in the CompensationPartitions table. All other rows
+# stay in the main database, in a table renamed to
+# CompensationUnpartitioned. Since SQLite can only attach a limited
+# number of databases (10 by default), N can never exceed that limit.
+#
+# New compensation rows are loaded into CompensationUnpartitioned.
+# Rerun the tool (e.g. after each filing season) to move them into
+# their year's file, creating files for new years and merging years
+# that are no longer among the N most recent back into the main
+# database. Each year is moved in its own transaction, so an
+# interrupted run leaves a consistent database and can be rerun.
+#
+# Author: Jessie Nouna
+#
+import argparse
+import os
+import re
+import sqlite3
+
+from datatier import PARTITION_PREFIX
+
+
+# number of recent years given their own file unless --recent is passed
+DEFAULT_RECENT_YEARS = 5
+
+
+##################################################################
+#
+# _partition_schema:
+#
+# Reads the definition of CompensationUnpartitioned and its indexes
+# from the main database, and rewrites them to create a Compensation
+# table (with the same indexes) in the given schema.
+#
+# Returns: list of create statements.
+#
+def _partition_schema(dbCursor, schema):
+    dbCursor.execute("""select sql from main.sqlite_master
+    where tbl_name = 'CompensationUnpartitioned' and sql is not null
+    order by type desc""")  # the table before its indexes
+
+    sqls = []
+    for row in dbCursor.fetchall():
+        sql = re.sub(r'["`\[]?\bCompensationUnpartitioned\b["`\]]?', 'Compensation', row[0])
+        pattern = r'^(\s*CREATE\s+(?:UNIQUE\s+)?(?:TABLE|INDEX)\s+(?:IF\s+NOT\s+EXISTS\s+)?)'
+        sqls.append(re.sub(pattern, rf'\g<1>{schema}.', sql, count=1, flags=re.IGNORECASE))
+    return sqls
+
+
+##################################################################
+#
+# _partition:
+#
+# Does the work of partition_database on an open connection.
+#
+# Returns: see partition_database.
+#
+def _partition(dbConn, filename, recent):
+    limit = dbConn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if recent < 1 or recent > limit:
+        print(f"partition failed: the number of recent years must be between 1 and {limit}")
+        return None
+
+    dbCursor = dbConn.cursor()
+    directory = os.path.dirname(os.path.abspath(filename))
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    schema = None
+    created = None
+    moved = False
+
+    try:
+        dbCursor.execute("""select name from sqlite_master where type = 'table'
+        and name in ('Compensation', 'CompensationUnpartitioned', 'CompensationPartitions')""")
+        names = [row[0] for row in dbCursor.fetchall()]
+
+        if "Compensation" in names:
+            if "CompensationPartitions" in names:
+                print("partition failed: the database has both Compensation and CompensationPartitions")
+                return None
+            # first run: everything starts out unpartitioned
+            dbCursor.execute("begin")
+            dbCursor.execute("alter table Compensation rename to CompensationUnpartitioned")
+            dbCursor.execute("""create table CompensationPartitions
+            (Year integer primary key, Filename text not null)""")
+            dbCursor.execute("commit")
+        elif "CompensationUnpartitioned" not in names or "CompensationPartitions" not in names:
+            print("partition failed: the database has no Compensation table")
+            return None
+
+        dbCursor.execute("select Year, Filename from CompensationPartitions")
+        partitions = dict(dbCursor.fetchall())
+        dbCursor.execute("""select distinct cast(strftime('%Y', Period_End) as integer)
+        from CompensationUnpartitioned where strftime('%Y', Period_End) is not null""")
+        unpartitioned = [row[0] for row in dbCursor.fetchall()]
+
+        # rows without a valid Period_End simply stay unpartitioned
+        target = sorted(set(partitions) | set(unpartitioned))[-recent:]
+
+        # merge partitions that are no longer recent back into the main database
+        for year in sorted(set(partitions) - set(target)):
+            schema = f"{PARTITION_PREFIX}{year}"
+            path = os.path.join(directory, partitions[year])
+            dbCursor.execute(f"attach database ? as {schema}", (path,))
+            dbCursor.execute("begin")
+            dbCursor.execute(f"insert into main.CompensationUnpartitioned select * from {schema}.Compensation")
+            dbCursor.execute("delete from CompensationPartitions where Year = ?", (year,))
+            dbCursor.execute("commit")
+            moved = True
+            dbCursor.execute(f"detach database {schema}")
+            schema = None
+            os.remove(path)
+
+        # move unpartitioned rows of recent years into their files
+        for year in target:
+            if year not in unpartitioned:
+                continue
+            schema = f"{PARTITION_PREFIX}{year}"
+            if year in partitions:
+                path = os.path.join(directory, partitions[year])
+            else:
+                partition_file = f"{stem}_{PARTITION_PREFIX}{year}.db"
+                path = os.path.join(directory, partition_file)
+                if os.path.exists(path):
+                    print(f"partition failed: {path} already exists but is not a partition of this database")
+                    return None
+                created = path
+            dbCursor.execute(f"attach database ? as {schema}", (path,))
+            dbCursor.execute("begin")
+            if created is not None:
+                for sql in _partition_schema(dbCursor, schema):
+                    dbCursor.execute(sql)
+                dbCursor.execute("insert into CompensationPartitions (Year, Filename) values (?, ?)",
+                                 (year, partition_file))
+            dbCursor.execute(f"""insert into {schema}.Compensation select * from main.CompensationUnpartitioned
+            where strftime('%Y', Period_End) = ?""", (f"{year:04d}",))
+            dbCursor.execute("delete from main.CompensationUnpartitioned where strftime('%Y', Period_End) = ?",
+                             (f"{year:04d}",))
+            dbCursor.execute("commit")
+            moved = True
+            dbCursor.execute(f"detach database {schema}")
+            schema = None
+            created = None
+
+        # reclaim the space the moved rows used to occupy
+        if moved:
+            dbCursor.execute("vacuum main")
+    except Exception as err:
+        if dbConn.in_transaction:
+            dbCursor.execute("rollback")
+        # undo the year that failed: detach it, and remove its file if new
+        if schema is not None:
+            dbCursor.execute("select name from pragma_database_list where name = ?", (schema,))
+            if dbCursor.fetchone() is not None:
+                dbCursor.execute(f"detach database {schema}")
+        if created is not None and os.path.exists(created):
+            os.remove(created)
+        print(f"partition failed: {err}")
+        return None
+    finally:
+        dbCursor.close()
+
+    return target
+
+
+##################################################################
+#
+# partition_database:
+#
+# Moves the Compensation rows of the given database into per-year
+# partition files for the given number of most recent years, as
+# described at the top of this file.
+#
+# Returns: the list of partitioned years; if the database cannot
+#          be partitioned, a msg is output and None is returned.
+#
+def partition_database(filename, recent=DEFAULT_RECENT_YEARS):
+    if not os.path.exists(filename):
+        print(f"partition failed: {filename} does not exist")
+        return None
+
+    dbConn = sqlite3.connect(filename, isolation_level=None)
+    try:
+        return _partition(dbConn, filename, recent)
+    finally:
+        dbConn.close()
+
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split Compensation into per-year database files.")
+    parser.add_argument("database", help="database file to partition")
+    parser.add_argument("--recent", type=int, default=DEFAULT_RECENT_YEARS,
+                        help="number of most recent years to give their own file")
+    args = parser.parse_args()
+
+    partitioned = partition_database(args.database, args.recent)
+    if partitioned is None:
+        raise SystemExit(1)
+
+    print(f"Partitioned Compensation into {len(partitioned)} yearly files: "
+          + ", ".join(str(year) for year in partitioned))
@@ -0,0 +1,105 @@
+#
+# test_contention.py
+#
+# Contention test for the data tier: several writer processes insert
+# rows through perform_action at the same time, using a short SQLite
+# timeout so that busy/locked errors go through the data tier's
+# retry with backoff. Every write must either succeed or be reported
+# as a BusyError; the successful write throughput is printed. Run as:
+#
+#   python -m pytest -s test_contention.py
+#
+# Author: Jessie Nouna
+#
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import datatier
+
+
+WRITERS = 4
+WRITES_PER_WRITER = 200
+
+
+##################################################################
+#
+# _writer:
+#
+# Performs WRITES_PER_WRITER inserts through perform_action and puts
+# a tuple (successes, busy errors, other errors) on the queue.
+#
+# Returns: None
+#
+def _writer(filename, writer_id, queue):
+    datatier.configure_retry(retries=8, base_delay=0.005, max_delay=0.2)
+    dbConn = sqlite3.connect(filename, timeout=0.01)
+    successes = 0
+    busy = 0
+    other = []
+
+    sql = "insert into Writes (Writer_ID, Seq) values (?, ?)"
+    for seq in range(WRITES_PER_WRITER):
+        try:
+            datatier.perform_action(dbConn, sql, (writer_id, seq), raise_errors=True)
+            successes += 1
+        except datatier.BusyError:
+            busy += 1
+        except Exception as err:
+            other.append(repr(err))
+
+    dbConn.close()
+    queue.put((successes, busy, other))
+
+
+class ContentionTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        dbConn = sqlite3.connect(self.filename)
+        dbConn.execute("create table Writes (Writer_ID integer, Seq integer, primary key (Writer_ID, Seq))")
+        dbConn.commit()
+        dbConn.close()
+
+    def tearDown(self):
+        for suffix in ("", "-journal"):
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+    def test_concurrent_writers(self):
+        queue = multiprocessing.Queue()
+        writers = [multiprocessing.Process(target=_writer, args=(self.filename, i, queue))
+                   for i in range(WRITERS)]
+
+        start = time.perf_counter()
+        for writer in writers:
+            writer.start()
+        results = [queue.get(timeout=120) for _ in writers]
+        for writer in writers:
+            writer.join()
+        elapsed = time.perf_counter() - start
+
+        successes = sum(result[0] for result in results)
+        busy = sum(result[1] for result in results)
+        other = [err for result in results for err in result[2]]
+
+        print(f"\n{WRITERS} writers: {successes} writes succeeded, {busy} busy, "
+              f"{successes / elapsed:,.1f} successful writes/s")
+
+        # every write either succeeded or was reported as busy
+        self.assertEqual(other, [])
+        self.assertEqual(successes + busy, WRITERS * WRITES_PER_WRITER)
+        self.assertGreater(successes, 0)
+
+        # and the database holds exactly the successful writes
+        dbConn = sqlite3.connect(self.filename)
+        count = dbConn.execute("select count(*) from Writes").fetchone()[0]
+        dbConn.close()
+        self.assertEqual(count, successes)
+
+
+if __name__ == "__main__":
+    unittest.main()